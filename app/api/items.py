@@ -6,6 +6,7 @@ from flask_login import login_required, current_user
 from . import api_bp
 from ..extensions import db
 from ..models import Item, AuditLog
+from ..utils.cache import bump_generation
 
 def _audit(entity_type, entity_pk_id, action, field=None, old=None, new=None, reason=None):
     db.session.add(AuditLog(
@@ -88,6 +89,7 @@ def create_item():
     db.session.add(i)
     _audit("ITEM", i.pk_id, "CREATE")
     db.session.commit()
+    bump_generation("items")
     return jsonify({"ok": True, "pk_id": i.pk_id}), 201
 
 @api_bp.patch("/items/<pk_id>")
@@ -117,6 +119,7 @@ def update_item(pk_id):
             _audit("ITEM", i.pk_id, "UPDATE", field=f, old=old, new=new)
 
     db.session.commit()
+    bump_generation("items")
     return jsonify({"ok": True})
 
 @api_bp.delete("/items/<pk_id>")
@@ -128,5 +131,6 @@ def delete_item(pk_id):
     db.session.delete(i)
     _audit("ITEM", pk_id, "DELETE")
     db.session.commit()
+    bump_generation("items")
     return jsonify({"ok": True})
 
@@ -2,16 +2,22 @@ from datetime import date
 from decimal import Decimal, ROUND_HALF_UP
 from flask import request, jsonify
 from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload
 
 from . import api_bp
 from ..extensions import db
 from ..models import Item, Sale, AuditLog
+from ..utils.cache import bump_generation
+
+# Decimal constants used by the snapshot maths (parsed once, not per call)
+ONE = Decimal("1")
+CENT = Decimal("0.01")
 
 def _q2(x: Decimal) -> Decimal:
-    return x.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    return x.quantize(CENT, rounding=ROUND_HALF_UP)
 
 def compute_snapshots(gross_price: Decimal, vat_rate: Decimal, total_cost_net: Decimal):
-    net_rev = _q2(gross_price / (Decimal("1.0") + vat_rate))
+    net_rev = _q2(gross_price / (ONE + vat_rate))
     vat_amt = _q2(gross_price - net_rev)
     profit = _q2(net_rev - total_cost_net)
     return net_rev, vat_amt, profit
@@ -54,7 +60,7 @@ def create_sale(item_pk_id):
     d = request.get_json(force=True) or {}
 
     gross = Decimal(str(d["item_selling_price_gross"]))
-    vat_rate = Decimal(str(item.vat_rate))
+    vat_rate = item.vat_rate
     packaging = Decimal(str(d.get("packaging_net", "0")))
     delivery_cost = Decimal(str(d.get("delivery_cost_net", "0")))
     other = Decimal(str(d.get("other_cost_net", "0")))
@@ -86,16 +92,18 @@ def create_sale(item_pk_id):
     _audit("SALE", s.pk_id, "CREATE")
     _audit("ITEM", item.pk_id, "UPDATE", field="status", old="IN_STOCK", new="SOLD")
     db.session.commit()
+    bump_generation("items")
 
     return jsonify({"ok": True, "sale_pk_id": s.pk_id}), 201
 
 @api_bp.patch("/sales/<sale_pk_id>")
 @login_required
 def update_sale(sale_pk_id):
-    s = db.session.get(Sale, sale_pk_id)
+    # Fetch the sale and its item in one round-trip
+    s = db.session.get(Sale, sale_pk_id, options=[joinedload(Sale.item)])
     if not s:
         return jsonify({"error": "not_found"}), 404
-    item = db.session.get(Item, s.item_pk_id)
+    item = s.item
     if not item:
         return jsonify({"error": "item_missing"}), 500
 
@@ -121,8 +129,8 @@ def update_sale(sale_pk_id):
             _audit("SALE", s.pk_id, "UPDATE", field=f, old=old, new=new, reason=d.get("reason"))
 
     # recompute snapshots every edit (per spec)
-    gross = Decimal(str(s.item_selling_price_gross))
-    vat_rate = Decimal(str(item.vat_rate))
+    gross = s.item_selling_price_gross
+    vat_rate = item.vat_rate
     total_cost = item.net_unit_cost + item.freight_net + s.packaging_net + s.delivery_cost_net + s.other_cost_net
     net_rev, vat_amt, profit = compute_snapshots(gross, vat_rate, total_cost)
 
@@ -139,12 +147,13 @@ def update_sale(sale_pk_id):
     s.item_profit = profit
 
     db.session.commit()
+    bump_generation("items")
     return jsonify({"ok": True})
 
 @api_bp.post("/sales/<sale_pk_id>/reverse")
 @login_required
 def reverse_sale(sale_pk_id):
-    s = db.session.get(Sale, sale_pk_id)
+    s = db.session.get(Sale, sale_pk_id, options=[joinedload(Sale.item)])
     if not s:
         return jsonify({"error": "not_found"}), 404
 
@@ -153,7 +162,7 @@ def reverse_sale(sale_pk_id):
     if not reason:
         return jsonify({"error": "reason_required"}), 400
 
-    item = db.session.get(Item, s.item_pk_id)
+    item = s.item
     if not item:
         return jsonify({"error": "item_missing"}), 500
 
@@ -164,5 +173,6 @@ def reverse_sale(sale_pk_id):
 
     db.session.delete(s)
     db.session.commit()
+    bump_generation("items")
     return jsonify({"ok": True})
 
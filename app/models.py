@@ -4,7 +4,7 @@ from decimal import Decimal
 
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import UniqueConstraint, Index
+from sqlalchemy import UniqueConstraint, Index, Computed, DDL, event
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy import ForeignKey, String, Date, DateTime, Numeric, Text
@@ -30,6 +30,25 @@ class User(db.Model, UserMixin):
 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # Users list: ORDER BY created_at DESC, pk_id DESC (pk_id also backs the keyset cursor)
+        Index("ix_users_created_at_pk", "created_at", "pk_id"),
+        # Users search is ILIKE '%q%' on email OR full_name OR role; trigram indexes on all
+        # three let Postgres answer it with a BitmapOr instead of a sequential scan
+        Index(
+            "ix_users_email_trgm", "email",
+            postgresql_using="gin", postgresql_ops={"email": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_users_full_name_trgm", "full_name",
+            postgresql_using="gin", postgresql_ops={"full_name": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_users_role_trgm", "role",
+            postgresql_using="gin", postgresql_ops={"role": "gin_trgm_ops"},
+        ),
+    )
+
     def set_password(self, password: str) -> None:
         self.password_hash = generate_password_hash(password)
 
@@ -64,6 +83,19 @@ class Item(db.Model):
     weight: Mapped[str | None] = mapped_column(String(120), nullable=True)
     comments: Mapped[str | None] = mapped_column(Text, nullable=True)
 
+    # Lower-cased search haystack maintained by the DB (generated column), so the
+    # inventory search is a single trigram-indexed LIKE instead of five ILIKEs.
+    # Deferred: only filters read it, so entity loads don't fetch it with every row
+    search_text: Mapped[str] = mapped_column(
+        Text,
+        Computed(
+            "lower(sku || ' | ' || order_number || ' | ' || company_name"
+            " || ' | ' || brand || ' | ' || item_description)",
+            persisted=True,
+        ),
+        deferred=True,
+    )
+
     net_unit_cost: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
     freight_net: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
     vat_rate: Mapped[Decimal] = mapped_column(Numeric(6, 4), nullable=False, default=Decimal("0.18"))
@@ -75,14 +107,30 @@ class Item(db.Model):
     sale: Mapped["Sale"] = relationship("Sale", back_populates="item", uselist=False, cascade="all, delete-orphan")
 
     __table_args__ = (
-        Index("ix_items_status", "status"),
+        # Serves the inventory list: WHERE status = ... ORDER BY arrival_date DESC, pk_id DESC
+        # (pk_id also backs the keyset cursor)
+        Index("ix_items_status_arrival", "status", "arrival_date", "pk_id"),
         Index("ix_items_sku", "sku"),
         Index("ix_items_order_number", "order_number"),
         Index("ix_items_arrival_date", "arrival_date"),
         Index("ix_items_order_date", "order_date"),
+        # Sold list filtered by order date: WHERE status = 'SOLD' AND order_date BETWEEN ...
+        Index("ix_items_status_order_date", "status", "order_date"),
+        Index(
+            "ix_items_search_text_trgm", "search_text",
+            postgresql_using="gin", postgresql_ops={"search_text": "gin_trgm_ops"},
+        ),
     )
 
 
+# Trigram indexes need the pg_trgm extension; create it ahead of the tables on PostgreSQL
+event.listen(
+    db.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+
 class Sale(db.Model):
     __tablename__ = "sales"
 
@@ -116,7 +164,9 @@ class Sale(db.Model):
     item: Mapped[Item] = relationship("Item", back_populates="sale")
 
     __table_args__ = (
-        Index("ix_sales_sale_date", "sale_date"),
+        # Sales list: ORDER BY sale_date DESC, joined back to items on item_pk_id.
+        # Postgres walks a B-tree backwards, so ascending columns serve the DESC sort
+        Index("ix_sales_sale_date_item", "sale_date", "item_pk_id"),
     )
 
 
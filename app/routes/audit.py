@@ -4,6 +4,7 @@ from sqlalchemy import or_
 from . import routes_bp
 from ..extensions import db
 from ..models import AuditLog, Item, User
+from ..utils.pagination import page_arg, per_page_arg, page_range as _page_range
 import math
 from urllib.parse import urlencode
 
@@ -15,13 +16,9 @@ def audit_list():
     q = (request.args.get("q") or "").strip()
     
     # Pagination
-    per_page = int(request.args.get("per_page", 25))
-    if per_page not in [25, 50, 100]:
-        per_page = 25
+    per_page = per_page_arg(request.args.get("per_page"))
     
-    page = int(request.args.get("page", 1))
-    if page < 1:
-        page = 1
+    page = page_arg(request.args.get("page"))
     
     # Base query with joins for item description and user email
     query = db.session.query(
@@ -74,26 +71,16 @@ def audit_list():
     end_item = min(offset + per_page, total_count)
     
     # Generate smart page range
-    page_range = []
-    if total_pages <= 7:
-        page_range = list(range(1, total_pages + 1))
-    else:
-        if page <= 4:
-            page_range = list(range(1, 6)) + ['...', total_pages]
-        elif page >= total_pages - 3:
-            page_range = [1, '...'] + list(range(total_pages - 4, total_pages + 1))
-        else:
-            page_range = [1, '...'] + list(range(page - 1, page + 2)) + ['...', total_pages]
+    page_range = _page_range(page, total_pages)
     
-    # Build URL helper
-    def build_url(target_page):
-        params = {}
-        if q:
-            params['q'] = q
-        if per_page != 25:
-            params['per_page'] = per_page
-        params['page'] = target_page
-        return url_for('routes.audit_list') + '?' + urlencode(params)
+    # Page links share everything but the page number, so build the prefix once
+    params = {}
+    if q:
+        params['q'] = q
+    if per_page != 25:
+        params['per_page'] = per_page
+    fixed_qs = urlencode(params)
+    page_url = url_for('routes.audit_list') + '?' + (fixed_qs + '&' if fixed_qs else '') + 'page='
     
     return render_template(
         "audit/list.html",
@@ -107,5 +94,5 @@ def audit_list():
         start_item=start_item,
         end_item=end_item,
         page_range=page_range,
-        build_url=build_url
+        page_url=page_url
     )
@@ -1,8 +1,11 @@
 import csv
 import json
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal, InvalidOperation
-from io import StringIO
+from functools import lru_cache
+from io import TextIOWrapper
+from itertools import islice
+from operator import itemgetter
 
 from flask import render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
@@ -10,39 +13,76 @@ from werkzeug.utils import secure_filename
 
 from . import routes_bp
 from ..extensions import db
-from ..models import ImportBatch, AuditLog, Item
+from ..models import ImportBatch, Item
+from ..utils.audit import audit, flush_audit
+from ..utils.cache import bump_generation
 
 
-def audit(entity_type, entity_pk_id, action, field=None, old=None, new=None, reason=None):
-    """Helper to create audit log entries"""
-    db.session.add(AuditLog(
-        entity_type=entity_type,
-        entity_pk_id=entity_pk_id,
-        action=action,
-        field_name=field,
-        old_value=None if old is None else str(old),
-        new_value=None if new is None else str(new),
-        reason=reason,
-        actor_user_id=getattr(current_user, "pk_id", None),
-    ))
+# Rows per bulk INSERT when committing a CSV import
+IMPORT_PAGE_SIZE = 10000
 
+# Column mapping (CSV header -> database field); order matters, rows are
+# unpacked positionally in imports_create
+COLUMN_MAP = {
+    'Unique ID': 'user_item_id',
+    'Order Number': 'order_number',
+    'Order Date': 'order_date',
+    'Arrival Date': 'arrival_date',
+    'Company Name': 'company_name',
+    'Brand': 'brand',
+    'Item Description': 'item_description',
+    'SKU': 'sku',
+    'Net Unit Cost': 'net_unit_cost',
+    'Freight': 'freight_net',
+    'Colour': 'colour',
+    'Size': 'size',
+    'Dimension': 'dimension',
+    'Weight': 'weight',
+    'Comments': 'comments',
+}
 
+# Decimal constants for the per-row mapping (parsed once, not per row)
+ZERO = Decimal("0.00")
+DEFAULT_VAT_RATE = Decimal("0.18")  # Default 18%
+
+# Required fields that must be present and non-empty
+REQUIRED_FIELDS = (
+    'Unique ID', 'Order Number', 'Order Date', 'Arrival Date',
+    'Company Name', 'Brand', 'Item Description', 'SKU',
+    'Net Unit Cost', 'Freight'
+)
+
+
+# Date and cost columns repeat heavily across rows of one order/shipment, so the
+# parsers are memoized: each distinct value is parsed once per worker
+@lru_cache(maxsize=4096)
 def parse_date(date_str):
     """Parse DD/MM/YYYY format to date object"""
-    if not date_str or not date_str.strip():
+    s = date_str.strip() if date_str else ''
+    if not s:
         return None
     try:
-        return datetime.strptime(date_str.strip(), "%d/%m/%Y").date()
+        # Zero-padded DD/MM/YYYY (the usual case): slice it directly. Every part must
+        # be ASCII digits, since int() would also accept spaces and signs
+        if (len(s) == 10 and s[2] == '/' and s[5] == '/'
+                and (d := s[0:2]).isdigit() and (m := s[3:5]).isdigit()
+                and (y := s[6:10]).isdigit() and s.isascii()):
+            return date(int(y), int(m), int(d))
+        # Anything else (e.g. 1/2/2024) goes through strptime as before
+        return datetime.strptime(s, "%d/%m/%Y").date()
     except ValueError:
         return None
 
 
+@lru_cache(maxsize=4096)
 def parse_decimal(value_str):
     """Parse string to Decimal, handling empty values"""
-    if not value_str or not str(value_str).strip():
-        return Decimal("0.00")
+    # CSV cells are already str, so strip once and hand that straight to Decimal
+    s = value_str.strip() if isinstance(value_str, str) else str(value_str or '').strip()
+    if not s:
+        return ZERO
     try:
-        return Decimal(str(value_str).strip())
+        return Decimal(s)
     except (ValueError, InvalidOperation):
         return None
 
@@ -82,182 +122,202 @@ def imports_create():
         flash("File must be a CSV", "error")
         return redirect(url_for("routes.imports_new"))
     
-    # Read CSV content
+    # Stream the CSV straight from the upload rather than reading it into memory
     try:
-        content = file.read().decode('utf-8-sig')  # Handle BOM
-        csv_file = StringIO(content)
-        reader = csv.DictReader(csv_file)
+        csv_file = TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')  # Handle BOM
+        reader = csv.reader(csv_file)
+        header = next(reader, [])
     except Exception as e:
         flash(f"Error reading CSV file: {str(e)}", "error")
         return redirect(url_for("routes.imports_new"))
     
-    # Column mapping (CSV header -> database field)
-    COLUMN_MAP = {
-        'Unique ID': 'user_item_id',
-        'Order Number': 'order_number',
-        'Order Date': 'order_date',
-        'Arrival Date': 'arrival_date',
-        'Company Name': 'company_name',
-        'Brand': 'brand',
-        'Item Description': 'item_description',
-        'SKU': 'sku',
-        'Net Unit Cost': 'net_unit_cost',
-        'Freight': 'freight_net',
-        'Colour': 'colour',
-        'Size': 'size',
-        'Dimension': 'dimension',
-        'Weight': 'weight',
-        'Comments': 'comments',
-    }
-    
-    # Required fields that must be present and non-empty
-    REQUIRED_FIELDS = [
-        'Unique ID', 'Order Number', 'Order Date', 'Arrival Date',
-        'Company Name', 'Brand', 'Item Description', 'SKU',
-        'Net Unit Cost', 'Freight'
-    ]
+    # Resolve each known column to its position once; rows are then read by index.
+    # Columns absent from the header point at a trailing '' cell added to every row.
+    width = len(header)
+    positions = {name: i for i, name in enumerate(header)}
+    get_columns = itemgetter(*(positions.get(name, width) for name in COLUMN_MAP))
+    get_required = itemgetter(*(positions.get(name, width) for name in REQUIRED_FIELDS))
     
     # Process rows
     total_rows = 0
     success_rows = 0
     failed_rows = 0
     errors = []
+    db_ids = set()        # Unique IDs already in the database
+    seen_in_file = {}     # Unique ID -> row that first used it in this file
+    uid_pos = positions.get('Unique ID', width)
+    actor_id = current_user.pk_id  # resolve the LocalProxy once, not per row
     
-    for row_num, row in enumerate(reader, start=2):  # Start at 2 (header is row 1)
-        total_rows += 1
-        
-        # Skip completely empty rows
-        if all(not v or not str(v).strip() for v in row.values()):
-            total_rows -= 1  # Don't count empty rows
-            continue
-        
-        # Validate required fields
-        missing_fields = []
-        for field in REQUIRED_FIELDS:
-            if field not in row or not row[field] or not str(row[field]).strip():
-                missing_fields.append(field)
-        
-        if missing_fields:
-            failed_rows += 1
-            errors.append({
-                'row': row_num,
-                'unique_id': row.get('Unique ID', 'N/A'),
-                'error': f"Missing required fields: {', '.join(missing_fields)}"
-            })
-            continue
-        
-        # Check for duplicate Unique ID
-        existing_item = db.session.query(Item).filter_by(
-            user_item_id=row['Unique ID'].strip()
-        ).first()
-        
-        if existing_item:
-            failed_rows += 1
-            errors.append({
-                'row': row_num,
-                'unique_id': row['Unique ID'],
-                'error': f"Duplicate ID - already exists in database"
-            })
-            continue
-        
-        # Parse dates
-        order_date = parse_date(row['Order Date'])
-        arrival_date = parse_date(row['Arrival Date'])
-        
-        if not order_date:
-            failed_rows += 1
-            errors.append({
-                'row': row_num,
-                'unique_id': row['Unique ID'],
-                'error': f"Invalid Order Date format (expected DD/MM/YYYY): {row['Order Date']}"
-            })
-            continue
-        
-        if not arrival_date:
-            failed_rows += 1
-            errors.append({
-                'row': row_num,
-                'unique_id': row['Unique ID'],
-                'error': f"Invalid Arrival Date format (expected DD/MM/YYYY): {row['Arrival Date']}"
-            })
-            continue
-        
-        # Parse numeric fields
-        net_unit_cost = parse_decimal(row['Net Unit Cost'])
-        freight_net = parse_decimal(row['Freight'])
-        
-        if net_unit_cost is None:
-            failed_rows += 1
-            errors.append({
-                'row': row_num,
-                'unique_id': row['Unique ID'],
-                'error': f"Invalid Net Unit Cost: {row['Net Unit Cost']}"
-            })
-            continue
+    # Work through the file a page at a time: one duplicate-ID query and one
+    # bulk INSERT per page, so memory stays bounded however large the upload is
+    row_iter = enumerate(reader, start=2)  # Start at 2 (header is row 1)
+    # Nothing pending needs to reach the database before the per-page ID lookups,
+    # so keep the session from autoflushing inside the loop
+    # A database error anywhere in the import (e.g. an over-long value, or a Unique ID
+    # inserted by a concurrent import after the page lookup) rolls the whole batch back
+    try:
+        with db.session.no_autoflush:
+            while True:
+                try:
+                    page = []
+                    for row_num, row in islice(row_iter, IMPORT_PAGE_SIZE):
+                        if len(row) != width:
+                            row = (row + [''] * width)[:width]
+                        row.append('')
+                        page.append((row_num, row))
+                except (UnicodeDecodeError, csv.Error) as e:
+                    db.session.rollback()
+                    flash(f"Error reading CSV file: {str(e)}", "error")
+                    return redirect(url_for("routes.imports_new"))
+                if not page:
+                    break
         
-        if freight_net is None:
-            failed_rows += 1
-            errors.append({
-                'row': row_num,
-                'unique_id': row['Unique ID'],
-                'error': f"Invalid Freight: {row['Freight']}"
-            })
-            continue
+                # Look up this page's Unique IDs with one query instead of one per row
+                # (IDs accepted earlier in the file were inserted by then, so skip those too)
+                ids = {row[uid_pos].strip() for _, row in page} - db_ids - seen_in_file.keys()
+                ids.discard('')
+                if ids:
+                    db_ids.update(
+                        uid for (uid,) in db.session.query(Item.user_item_id).filter(Item.user_item_id.in_(ids))
+                    )
         
-        # Create Item
-        try:
-            item = Item(
-                user_item_id=row['Unique ID'].strip(),
-                status='IN_STOCK',
-                order_number=row['Order Number'].strip(),
-                order_date=order_date,
-                arrival_date=arrival_date,
-                company_name=row['Company Name'].strip(),
-                brand=row['Brand'].strip(),
-                item_description=row['Item Description'].strip(),
-                sku=row['SKU'].strip(),
-                net_unit_cost=net_unit_cost,
-                freight_net=freight_net,
-                vat_rate=Decimal("0.18"),  # Default 18%
-                colour=row.get('Colour', '').strip() or None,
-                size=row.get('Size', '').strip() or None,
-                dimension=row.get('Dimension', '').strip() or None,
-                weight=row.get('Weight', '').strip() or None,
-                comments=row.get('Comments', '').strip() or None,
-                created_by=current_user.pk_id
-            )
+                mappings = []
+                for row_num, row in page:
+                    # Skip completely empty rows (not counted)
+                    if not ''.join(row).strip():
+                        continue
+                    total_rows += 1
             
-            db.session.add(item)
-            success_rows += 1
+                    (unique_id, order_number, order_date_str, arrival_date_str, company_name,
+                     brand, item_description, sku, net_unit_cost_str, freight_str,
+                     colour, size, dimension, weight, comments) = get_columns(row)
             
-        except Exception as e:
-            failed_rows += 1
-            errors.append({
-                'row': row_num,
-                'unique_id': row.get('Unique ID', 'N/A'),
-                'error': f"Database error: {str(e)}"
-            })
-            continue
-    
-    # Create ImportBatch record
-    batch = ImportBatch(
-        filename=secure_filename(file.filename),
-        uploaded_by=current_user.pk_id,
-        total_rows=total_rows,
-        success_rows=success_rows,
-        failed_rows=failed_rows,
-        error_report=json.dumps(errors, indent=2) if errors else None
-    )
-    db.session.add(batch)
-    db.session.flush()  # ADD THIS LINE - generates the pk_id
+                    # Check for duplicate Unique ID first: set lookups against the IDs already
+                    # in the database and those accepted earlier in this file, so repeats skip
+                    # the rest of the validation
+                    uid = unique_id.strip()
+                    if uid and uid in db_ids:
+                        failed_rows += 1
+                        errors.append({
+                            'row': row_num,
+                            'unique_id': unique_id,
+                            'error': f"Duplicate ID - already exists in database"
+                        })
+                        continue
+                    if uid and uid in seen_in_file:
+                        failed_rows += 1
+                        errors.append({
+                            'row': row_num,
+                            'unique_id': unique_id,
+                            'error': f"Duplicate ID - repeated in this file (row {seen_in_file[uid]})"
+                        })
+                        continue
+            
+                    # Validate required fields
+                    missing_fields = [
+                        f for f, v in zip(REQUIRED_FIELDS, get_required(row)) if not v.strip()
+                    ]
+            
+                    if missing_fields:
+                        failed_rows += 1
+                        errors.append({
+                            'row': row_num,
+                            'unique_id': unique_id if 'Unique ID' in positions else 'N/A',
+                            'error': f"Missing required fields: {', '.join(missing_fields)}"
+                        })
+                        continue
+            
+                    # Parse dates
+                    order_date = parse_date(order_date_str)
+                    arrival_date = parse_date(arrival_date_str)
+            
+                    if not order_date:
+                        failed_rows += 1
+                        errors.append({
+                            'row': row_num,
+                            'unique_id': unique_id,
+                            'error': f"Invalid Order Date format (expected DD/MM/YYYY): {order_date_str}"
+                        })
+                        continue
+            
+                    if not arrival_date:
+                        failed_rows += 1
+                        errors.append({
+                            'row': row_num,
+                            'unique_id': unique_id,
+                            'error': f"Invalid Arrival Date format (expected DD/MM/YYYY): {arrival_date_str}"
+                        })
+                        continue
+            
+                    # Parse numeric fields
+                    net_unit_cost = parse_decimal(net_unit_cost_str)
+                    freight_net = parse_decimal(freight_str)
+            
+                    if net_unit_cost is None:
+                        failed_rows += 1
+                        errors.append({
+                            'row': row_num,
+                            'unique_id': unique_id,
+                            'error': f"Invalid Net Unit Cost: {net_unit_cost_str}"
+                        })
+                        continue
+            
+                    if freight_net is None:
+                        failed_rows += 1
+                        errors.append({
+                            'row': row_num,
+                            'unique_id': unique_id,
+                            'error': f"Invalid Freight: {freight_str}"
+                        })
+                        continue
+            
+                    # Queue Item row for this page's bulk insert
+                    mapping = {
+                        'user_item_id': uid,
+                        'status': 'IN_STOCK',
+                        'order_number': order_number.strip(),
+                        'order_date': order_date,
+                        'arrival_date': arrival_date,
+                        'company_name': company_name.strip(),
+                        'brand': brand.strip(),
+                        'item_description': item_description.strip(),
+                        'sku': sku.strip(),
+                        'net_unit_cost': net_unit_cost,
+                        'freight_net': freight_net,
+                        'vat_rate': DEFAULT_VAT_RATE,
+                        'colour': colour.strip() or None,
+                        'size': size.strip() or None,
+                        'dimension': dimension.strip() or None,
+                        'weight': weight.strip() or None,
+                        'comments': comments.strip() or None,
+                        'created_by': actor_id,
+                    }
+                    mappings.append(mapping)
+                    seen_in_file[uid] = row_num  # catch repeats later in the same file
+                    success_rows += 1
+        
+                if mappings:
+                    db.session.bulk_insert_mappings(Item, mappings)
     
-    # Create audit log
-    audit("IMPORT_BATCH", batch.pk_id, "CREATE", reason=f"Imported {success_rows}/{total_rows} items")
+        # Create ImportBatch record
+        batch = ImportBatch(
+            filename=secure_filename(file.filename),
+            uploaded_by=actor_id,
+            total_rows=total_rows,
+            success_rows=success_rows,
+            failed_rows=failed_rows,
+            error_report=json.dumps(errors, indent=2) if errors else None
+        )
+        db.session.add(batch)
+        db.session.flush()  # ADD THIS LINE - generates the pk_id
     
-    # Commit everything
+        # Create audit log
+        audit("IMPORT_BATCH", batch.pk_id, "CREATE", reason=f"Imported {success_rows}/{total_rows} items", actor_id=actor_id)
     
-    try:
+        # Commit everything
+        flush_audit()
         db.session.commit()
+        bump_generation("items")
         
         if failed_rows > 0:
             flash(f"Import completed: {success_rows} succeeded, {failed_rows} failed. Check error report below.", "ok")
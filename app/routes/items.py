@@ -1,65 +1,58 @@
 from flask import render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
-from sqlalchemy import or_
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.orm import load_only
 
 from . import routes_bp
 from ..extensions import db
-from ..models import Item, AuditLog
+from ..models import Item
 from ..forms import ItemForm
+from ..utils.audit import audit, flush_audit
+from ..utils.cache import cached, bump_generation
+from ..utils.csv_stream import csv_response
+from ..utils.pagination import page_arg, per_page_arg, page_range as _page_range
 
 
-def audit(entity_type, entity_pk_id, action, field=None, old=None, new=None, reason=None):
-    db.session.add(
-        AuditLog(
-            entity_type=entity_type,
-            entity_pk_id=entity_pk_id,
-            action=action,
-            field_name=field,
-            old_value=None if old is None else str(old),
-            new_value=None if new is None else str(new),
-            reason=reason,
-            actor_user_id=getattr(current_user, "pk_id", None),
-        )
-    )
-
+# Statement pieces shared by every list/export request, built once at import
+# rather than per request (SQLAlchemy caches the compiled SQL by structure)
+_IN_STOCK = Item.status == "IN_STOCK"
+_LIST_ORDER = (Item.arrival_date.desc(), Item.pk_id.desc())
+_LIST_LOAD_ONLY = load_only(
+    Item.pk_id, Item.user_item_id, Item.status, Item.order_number, Item.order_date,
+    Item.arrival_date, Item.company_name, Item.brand, Item.item_description, Item.sku,
+    Item.colour, Item.size, Item.dimension, Item.comments,
+    Item.net_unit_cost, Item.freight_net, Item.vat_rate,
+)
+_EXPORT_COLUMNS = (
+    Item.user_item_id, Item.order_number, Item.order_date, Item.arrival_date,
+    Item.company_name, Item.brand, Item.item_description, Item.sku,
+    Item.net_unit_cost, Item.freight_net, Item.colour, Item.size,
+    Item.dimension, Item.weight, Item.comments,
+)
 
-@routes_bp.get("/items")
-@login_required
-def items_list():
-    from datetime import datetime
-    import math
-    from urllib.parse import urlencode
-    
-    q = (request.args.get("q") or "").strip()
+# Fields editable through ItemForm (diffed and audited on update)
+_EDITABLE_FIELDS = (
+    "user_item_id",
+    "order_number",
+    "order_date",
+    "arrival_date",
+    "company_name",
+    "brand",
+    "item_description",
+    "sku",
+    "net_unit_cost",
+    "freight_net",
+    "vat_rate",
+)
 
-    date_type = request.args.get("date_type", "arrival")
-    date_from = (request.args.get("date_from") or "").strip()
-    date_to = (request.args.get("date_to") or "").strip()
-    
-    # Pagination
-    per_page = int(request.args.get("per_page", 25))
-    if per_page not in [25, 50, 100]:
-        per_page = 25
-    
-    page = int(request.args.get("page", 1))
-    if page < 1:
-        page = 1
 
-    # Inventory page = IN_STOCK only (per spec)
-    query = db.session.query(Item).filter(Item.status == "IN_STOCK")
+def _filter_items(query, q, date_type, date_from, date_to):
+    """Apply the inventory search and date-range filters; returns (query, dates_valid)"""
+    from datetime import datetime
 
-    # Search: SKU, Order #, Supplier (Company), Brand, Description
+    # Search: SKU, Order #, Supplier (Company), Brand, Description (via Item.search_text)
     if q:
-        like = f"%{q}%"
-        query = query.filter(
-            or_(
-                Item.sku.ilike(like),
-                Item.order_number.ilike(like),
-                Item.company_name.ilike(like),
-                Item.brand.ilike(like),
-                Item.item_description.ilike(like),
-            )
-        )
+        query = query.filter(Item.search_text.like(f"%{q.lower()}%"))
 
     # Date range based on selected type - convert strings to date objects
     try:
@@ -77,57 +70,100 @@ def items_list():
             if date_to:
                 date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
                 query = query.filter(Item.arrival_date <= date_to_obj)
-    except ValueError as e:
+    except ValueError:
+        return query, False
+
+    return query, True
+
+
+@routes_bp.get("/items")
+@login_required
+def items_list():
+    from datetime import datetime
+    import math
+    from urllib.parse import urlencode
+    
+    q = (request.args.get("q") or "").strip()
+
+    date_type = request.args.get("date_type", "arrival")
+    date_from = (request.args.get("date_from") or "").strip()
+    date_to = (request.args.get("date_to") or "").strip()
+    
+    # Pagination
+    per_page = per_page_arg(request.args.get("per_page"))
+    
+    page = page_arg(request.args.get("page"))
+
+    # Keyset cursor (last row of the previous page), sent by the "next" link
+    after_arrival = (request.args.get("after_arrival") or "").strip()
+    after_id = (request.args.get("after_id") or "").strip()
+
+    # Inventory page = IN_STOCK only (per spec); load only what the list template renders
+    query = db.session.query(Item).options(_LIST_LOAD_ONLY).filter(_IN_STOCK)
+
+    query, dates_valid = _filter_items(query, q, date_type, date_from, date_to)
+    if not dates_valid:
         flash(f"Invalid date format. Please use the date picker.", "error")
 
-    # Count total
-    total_count = query.count()
+    # Count total (cached per filter set until the next item write)
+    total_count = cached("items", ("items_list", q, date_type, date_from, date_to), query.count)
     total_pages = math.ceil(total_count / per_page) if total_count > 0 else 1
     
     # Ensure page doesn't exceed total pages
     if page > total_pages:
         page = total_pages
     
-    # Get items for current page
+    # Get items for current page; pk_id breaks arrival_date ties so pages are stable
     offset = (page - 1) * per_page
-    items = query.order_by(Item.arrival_date.desc()).limit(per_page).offset(offset).all()
+    page_query = query.order_by(*_LIST_ORDER)
+    cursor = None
+    if page > 1 and after_arrival and after_id:
+        try:
+            cursor = (datetime.strptime(after_arrival, '%Y-%m-%d').date(), after_id)
+        except ValueError:
+            cursor = None
+    if cursor:
+        # Seek past the previous page instead of scanning and discarding OFFSET rows
+        items = page_query.filter(
+            tuple_(Item.arrival_date, Item.pk_id) < tuple_(*cursor)
+        ).limit(per_page).all()
+    else:
+        items = page_query.limit(per_page).offset(offset).all()
     
     # Calculate display range
     start_item = offset + 1 if total_count > 0 else 0
     end_item = min(offset + per_page, total_count)
     
     # Generate smart page range
-    page_range = []
-    if total_pages <= 7:
-        # Show all pages
-        page_range = list(range(1, total_pages + 1))
-    else:
-        # Smart pagination with ellipsis
-        if page <= 4:
-            # Near start: 1 2 3 4 5 ... last
-            page_range = list(range(1, 6)) + ['...', total_pages]
-        elif page >= total_pages - 3:
-            # Near end: 1 ... -4 -3 -2 -1 last
-            page_range = [1, '...'] + list(range(total_pages - 4, total_pages + 1))
-        else:
-            # Middle: 1 ... page-1 page page+1 ... last
-            page_range = [1, '...'] + list(range(page - 1, page + 2)) + ['...', total_pages]
+    page_range = _page_range(page, total_pages)
     
-    # Build URL helper
+    # Build URL helper: the filter part of the query string is the same for
+    # every pager link, so resolve the route and encode it once
+    params = {}
+    if q:
+        params['q'] = q
+    if date_type and date_type != 'arrival':
+        params['date_type'] = date_type
+    if date_from:
+        params['date_from'] = date_from
+    if date_to:
+        params['date_to'] = date_to
+    if per_page != 25:
+        params['per_page'] = per_page
+    fixed_qs = urlencode(params)
+    page_url = url_for('routes.items_list') + '?' + (fixed_qs + '&' if fixed_qs else '') + 'page='
+
     def build_url(target_page):
-        params = {}
-        if q:
-            params['q'] = q
-        if date_type and date_type != 'arrival':
-            params['date_type'] = date_type
-        if date_from:
-            params['date_from'] = date_from
-        if date_to:
-            params['date_to'] = date_to
-        if per_page != 25:
-            params['per_page'] = per_page
-        params['page'] = target_page
-        return url_for('routes.items_list') + '?' + urlencode(params)
+        return f"{page_url}{target_page}"
+
+    # "Next" carries a cursor so the following page is a seek, not an OFFSET
+    next_url = None
+    if items and page < total_pages:
+        last = items[-1]
+        next_url = build_url(page + 1) + '&' + urlencode({
+            'after_arrival': last.arrival_date.isoformat(),
+            'after_id': last.pk_id,
+        })
 
     return render_template(
         "items/list.html",
@@ -145,8 +181,41 @@ def items_list():
         end_item=end_item,
         page_range=page_range,
         build_url=build_url,
+        next_url=next_url,
     )
 
+@routes_bp.get("/items.csv")
+@login_required
+def items_export_csv():
+    """Stream the filtered inventory list as CSV (same columns as the import file)"""
+    q = (request.args.get("q") or "").strip()
+    date_type = request.args.get("date_type", "arrival")
+    date_from = (request.args.get("date_from") or "").strip()
+    date_to = (request.args.get("date_to") or "").strip()
+
+    # Plain column tuples: no ORM hydration, and only the exported fields
+    query = db.session.query(*_EXPORT_COLUMNS).filter(_IN_STOCK)
+    query, _ = _filter_items(query, q, date_type, date_from, date_to)
+    query = query.order_by(*_LIST_ORDER)
+
+    # yield_per streams from a server-side cursor instead of loading every row
+    rows = (
+        [
+            row.user_item_id, row.order_number,
+            row.order_date.strftime('%d/%m/%Y'), row.arrival_date.strftime('%d/%m/%Y'),
+            row.company_name, row.brand, row.item_description, row.sku,
+            row.net_unit_cost, row.freight_net, row.colour or '', row.size or '',
+            row.dimension or '', row.weight or '', row.comments or '',
+        ]
+        for row in query.yield_per(1000)
+    )
+    return csv_response("inventory.csv", [
+        'Unique ID', 'Order Number', 'Order Date', 'Arrival Date', 'Company Name',
+        'Brand', 'Item Description', 'SKU', 'Net Unit Cost', 'Freight',
+        'Colour', 'Size', 'Dimension', 'Weight', 'Comments',
+    ], rows)
+
+
 @routes_bp.get("/items/new")
 @login_required
 def items_new():
@@ -180,7 +249,9 @@ def items_create():
     db.session.add(i)
     db.session.flush()  # ensure pk exists for audit
     audit("ITEM", i.pk_id, "CREATE")
+    flush_audit()
     db.session.commit()
+    bump_generation("items")
 
     flash("Item created.", "ok")
     return redirect(url_for("routes.items_list"))
@@ -211,26 +282,24 @@ def items_update(pk_id):
         flash("Please fix the highlighted fields.", "error")
         return render_template("items/edit.html", active_nav="items", form=form, item=i), 400
 
-    for f in [
-        "user_item_id",
-        "order_number",
-        "order_date",
-        "arrival_date",
-        "company_name",
-        "brand",
-        "item_description",
-        "sku",
-        "net_unit_cost",
-        "freight_net",
-        "vat_rate",
-    ]:
-        old = getattr(i, f)
-        new = getattr(form, f).data
-        if old != new:
-            setattr(i, f, new)
-            audit("ITEM", i.pk_id, "UPDATE", field=f, old=old, new=new)
+    changed = [
+        (f, old, new)
+        for f, old, new in ((f, getattr(i, f), getattr(form, f).data) for f in _EDITABLE_FIELDS)
+        if old != new
+    ]
+    if not changed:
+        # Nothing to write: skip the transaction and the cache invalidation
+        flash("Item updated.", "ok")
+        return redirect(url_for("routes.items_list"))
+
+    actor_id = current_user.pk_id
+    for f, old, new in changed:
+        setattr(i, f, new)
+        audit("ITEM", i.pk_id, "UPDATE", field=f, old=old, new=new, actor_id=actor_id)
 
+    flush_audit()
     db.session.commit()
+    bump_generation("items")
     flash("Item updated.", "ok")
     return redirect(url_for("routes.items_list"))
 
@@ -239,17 +308,25 @@ def items_update(pk_id):
 @login_required
 def items_update_comments(pk_id):
     """Update item comments via AJAX"""
-    i = db.session.get(Item, pk_id)
-    if not i:
+    comments = request.form.get("comments", "").strip() or None
+
+    # Read the current value with the row locked (SELECT ... FOR UPDATE), so the
+    # audit's "old" is exactly what this UPDATE replaces even if another edit to
+    # the same item is in flight; only the one column is fetched
+    row = db.session.execute(
+        select(Item.comments).where(Item.pk_id == pk_id).with_for_update()
+    ).first()
+    if row is None:
         return {"error": "Item not found"}, 404
-    
-    comments = request.form.get("comments", "").strip()
-    old_comments = i.comments
-    i.comments = comments if comments else None
-    
-    if old_comments != i.comments:
-        audit("ITEM", i.pk_id, "UPDATE", field="comments", old=old_comments, new=i.comments)
-    
+    old = row[0]
+    if old == comments:
+        # Already identical: nothing to write, just release the lock
+        db.session.rollback()
+        return {"success": True, "comments": comments or ""}
+
+    db.session.execute(update(Item).where(Item.pk_id == pk_id).values(comments=comments))
+    audit("ITEM", pk_id, "UPDATE", field="comments", old=old, new=comments)
+    flush_audit()
     db.session.commit()
-    return {"success": True, "comments": i.comments or ""}
+    return {"success": True, "comments": comments or ""}
 
@@ -1,33 +1,47 @@
 from decimal import Decimal
 from datetime import date
-from flask import render_template, redirect, url_for, flash, request, jsonify
+from operator import attrgetter
+from flask import render_template, redirect, url_for, flash, request, jsonify, make_response
 from flask_login import login_required, current_user
-from sqlalchemy import or_
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import contains_eager, joinedload, raiseload
 
 from . import routes_bp
 from ..extensions import db
-from ..models import Item, Sale, AuditLog
+from ..models import Item, Sale
+from ..utils.audit import audit, flush_audit
+from ..utils.cache import bump_generation, cached
+from ..utils.csv_stream import csv_response
+from ..utils.pagination import page_arg, per_page_arg, page_range as _page_range
 
 
-def audit(entity_type, entity_pk_id, action, field=None, old=None, new=None, reason=None):
-    db.session.add(
-        AuditLog(
-            entity_type=entity_type,
-            entity_pk_id=entity_pk_id,
-            action=action,
-            field_name=field,
-            old_value=None if old is None else str(old),
-            new_value=None if new is None else str(new),
-            reason=reason,
-            actor_user_id=getattr(current_user, "pk_id", None),
-        )
-    )
+# Decimal constants used by the sale maths (parsed once, not per call)
+ONE = Decimal("1")
+HUNDRED = Decimal("100")
+CENT = Decimal("0.01")
+
+# Item fields that must be set before it can be sold
+_SELL_REQUIRED_FIELDS = (
+    'user_item_id', 'order_number', 'order_date', 'arrival_date',
+    'company_name', 'brand', 'item_description', 'sku',
+    'net_unit_cost', 'freight_net', 'vat_rate'
+)
+_get_sell_required = attrgetter(*_SELL_REQUIRED_FIELDS)
+
+# Columns written by the sales CSV export
+_EXPORT_COLUMNS = (
+    Item.user_item_id, Item.item_description, Item.brand, Item.sku,
+    Sale.sale_date, Sale.item_selling_price_gross, Sale.discount_amount_gross,
+    Sale.delivery_fee_charged_gross, Sale.packaging_net, Sale.delivery_cost_net,
+    Sale.other_cost_net, Sale.item_net_revenue, Sale.item_vat_amount,
+    Sale.item_profit, Sale.notes,
+)
 
 
 def calculate_sale_metrics(selling_price_gross, vat_rate, net_unit_cost, freight_net, 
                           packaging_net, delivery_cost_net, other_cost_net):
     """Calculate net revenue, VAT amount, and profit for a sale"""
-    vat_multiplier = Decimal("1") + vat_rate
+    vat_multiplier = ONE + vat_rate
     
     # Net revenue = gross selling price / (1 + VAT rate)
     net_revenue = selling_price_gross / vat_multiplier
@@ -40,55 +54,23 @@ def calculate_sale_metrics(selling_price_gross, vat_rate, net_unit_cost, freight
     profit = net_revenue - total_costs
     
     return {
-        'net_revenue': net_revenue.quantize(Decimal('0.01')),
-        'vat_amount': vat_amount.quantize(Decimal('0.01')),
-        'profit': profit.quantize(Decimal('0.01'))
+        'net_revenue': net_revenue.quantize(CENT),
+        'vat_amount': vat_amount.quantize(CENT),
+        'profit': profit.quantize(CENT)
     }
 
 
-@routes_bp.get("/sales")
-@login_required
-def sales_list():
-    """List all sold items with their sale details"""
-    from datetime import datetime
-    import math
-    from urllib.parse import urlencode
-    
-    q = (request.args.get("q") or "").strip()
-    
-    date_type = (request.args.get("date_type") or "arrival").strip()
-    date_from = (request.args.get("date_from") or "").strip()
-    date_to = (request.args.get("date_to") or "").strip()
-    
-    # Pagination
-    per_page = int(request.args.get("per_page", 25))
-    if per_page not in [25, 50, 100]:
-        per_page = 25
-    
-    page = int(request.args.get("page", 1))
-    if page < 1:
-        page = 1
-    
-    # Join items with sales
-    query = db.session.query(Item).join(Sale).filter(Item.status == "SOLD")
-    
+def _filter_sales(query, q, date_type, date_from, date_to):
+    """Apply the sales search and date-range filters; returns (query, dates_valid)"""
     # Search
     if q:
-        like = f"%{q}%"
-        query = query.filter(
-            or_(
-                Item.sku.ilike(like),
-                Item.order_number.ilike(like),
-                Item.company_name.ilike(like),
-                Item.brand.ilike(like),
-                Item.item_description.ilike(like),
-            )
-        )
+        # One LIKE on the trigram-indexed search_text column (already lower-cased)
+        query = query.filter(Item.search_text.like(f"%{q.lower()}%"))
     
     # Date filtering with proper conversion based on date_type
     try:
         if date_from:
-            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date()
+            date_from_obj = date.fromisoformat(date_from)
             if date_type == 'order':
                 query = query.filter(Item.order_date >= date_from_obj)
             elif date_type == 'arrival':
@@ -97,7 +79,7 @@ def sales_list():
                 query = query.filter(Sale.sale_date >= date_from_obj)
         
         if date_to:
-            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
+            date_to_obj = date.fromisoformat(date_to)
             if date_type == 'order':
                 query = query.filter(Item.order_date <= date_to_obj)
             elif date_type == 'arrival':
@@ -105,10 +87,53 @@ def sales_list():
             elif date_type == 'sold':
                 query = query.filter(Sale.sale_date <= date_to_obj)
     except ValueError:
+        return query, False
+    
+    return query, True
+
+
+@routes_bp.get("/sales")
+@login_required
+def sales_list():
+    """List all sold items with their sale details"""
+    import math
+    from urllib.parse import urlencode
+    
+    q = (request.args.get("q") or "").strip()
+    
+    date_type = (request.args.get("date_type") or "arrival").strip()
+    date_from = (request.args.get("date_from") or "").strip()
+    date_to = (request.args.get("date_to") or "").strip()
+    
+    # Pagination
+    per_page = per_page_arg(request.args.get("per_page"))
+    
+    page = page_arg(request.args.get("page"))
+    
+    # Keyset cursor (last row of the previous page), sent by the "next" link
+    after_sold = (request.args.get("after_sold") or "").strip()
+    after_id = (request.args.get("after_id") or "").strip()
+    
+    # Join items with sales. The page is read-only, so the count and page queries
+    # (both derived from this one) skip the autoflush check
+    query = db.session.query(Item).autoflush(False).join(Item.sale).filter(Item.status == "SOLD")
+    
+    query, dates_valid = _filter_sales(query, q, date_type, date_from, date_to)
+    if not dates_valid:
         flash("Invalid date format. Please use the date picker.", "error")
     
-    # Count total
-    total_count = query.count()
+    # Count and money totals for the whole filtered set in one aggregate query (plain
+    # COUNT/SUM over the join rather than .count()'s wrapped subquery). Paging through
+    # the same filters reuses it until a sale or item write bumps the generation
+    total_count, total_revenue, total_profit = cached(
+        "items",
+        ("sales_list", q, date_type, date_from, date_to),
+        query.with_entities(
+            func.count(Item.pk_id),
+            func.coalesce(func.sum(Sale.item_net_revenue), 0),
+            func.coalesce(func.sum(Sale.item_profit), 0),
+        ).one,
+    )
     total_pages = math.ceil(total_count / per_page) if total_count > 0 else 1
     
     # Ensure page doesn't exceed total pages
@@ -117,41 +142,63 @@ def sales_list():
     
     # Get items for current page
     offset = (page - 1) * per_page
-    items = query.order_by(Sale.sale_date.desc()).limit(per_page).offset(offset).all()
+    # Fill item.sale from the joined row so the template doesn't lazy-load one sale per item;
+    # any other relationship access raises instead of quietly reintroducing an N+1.
+    # item_pk_id (unique per sale) breaks sale_date ties so pages are stable, and together
+    # they match ix_sales_sale_date_item
+    page_query = query.options(contains_eager(Item.sale), raiseload("*")).order_by(
+        Sale.sale_date.desc(), Sale.item_pk_id.desc()
+    )
+    cursor = None
+    if page > 1 and after_sold and after_id:
+        try:
+            cursor = (date.fromisoformat(after_sold), after_id)
+        except ValueError:
+            cursor = None
+    if cursor:
+        # Seek past the previous page instead of scanning and discarding OFFSET rows
+        items = page_query.filter(
+            tuple_(Sale.sale_date, Sale.item_pk_id) < tuple_(*cursor)
+        ).limit(per_page).all()
+    else:
+        items = page_query.limit(per_page).offset(offset).all()
     
     # Calculate display range
     start_item = offset + 1 if total_count > 0 else 0
     end_item = min(offset + per_page, total_count)
     
     # Generate smart page range
-    page_range = []
-    if total_pages <= 7:
-        page_range = list(range(1, total_pages + 1))
-    else:
-        if page <= 4:
-            page_range = list(range(1, 6)) + ['...', total_pages]
-        elif page >= total_pages - 3:
-            page_range = [1, '...'] + list(range(total_pages - 4, total_pages + 1))
-        else:
-            page_range = [1, '...'] + list(range(page - 1, page + 2)) + ['...', total_pages]
-    
-    # Build URL helper
-    def build_url(target_page):
-        params = {}
-        if q:
-            params['q'] = q
-        if date_type != 'arrival':  # arrival is default
-            params['date_type'] = date_type
-        if date_from:
-            params['date_from'] = date_from
-        if date_to:
-            params['date_to'] = date_to
-        if per_page != 25:
-            params['per_page'] = per_page
-        params['page'] = target_page
-        return url_for('routes.sales_list') + '?' + urlencode(params)
+    page_range = _page_range(page, total_pages)
     
-    return render_template(
+    # Build URL helper: the filter part of the query string is the same for
+    # every pager link, so resolve the route and encode it once
+    params = {}
+    if q:
+        params['q'] = q
+    if date_type != 'arrival':  # arrival is default
+        params['date_type'] = date_type
+    if date_from:
+        params['date_from'] = date_from
+    if date_to:
+        params['date_to'] = date_to
+    if per_page != 25:
+        params['per_page'] = per_page
+    fixed_qs = urlencode(params)
+    page_url = url_for('routes.sales_list') + '?' + (fixed_qs + '&' if fixed_qs else '') + 'page='
+
+    def build_url(target_page):
+        return f"{page_url}{target_page}"
+
+    # "Next" carries a cursor so the following page is a seek, not an OFFSET
+    next_url = None
+    if items and page < total_pages:
+        last = items[-1]
+        next_url = build_url(page + 1) + '&' + urlencode({
+            'after_sold': last.sale.sale_date.isoformat(),
+            'after_id': last.pk_id,
+        })
+    
+    response = make_response(render_template(
         "sales/list.html",
         active_nav="sales",
         items=items,
@@ -163,11 +210,54 @@ def sales_list():
         page=page,
         total_pages=total_pages,
         total_count=total_count,
+        total_revenue=total_revenue,
+        total_profit=total_profit,
         start_item=start_item,
         end_item=end_item,
         page_range=page_range,
         build_url=build_url,
+        next_url=next_url,
+    ))
+    # Per-user data: never shared, and re-fetched rather than reused from history
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@routes_bp.get("/sales.csv")
+@login_required
+def sales_export_csv():
+    """Stream the filtered sales list as CSV"""
+    q = (request.args.get("q") or "").strip()
+    date_type = (request.args.get("date_type") or "arrival").strip()
+    date_from = (request.args.get("date_from") or "").strip()
+    date_to = (request.args.get("date_to") or "").strip()
+    
+    # Plain column tuples: no ORM hydration, and only the exported fields
+    query = (
+        db.session.query(*_EXPORT_COLUMNS)
+        .select_from(Item)
+        .join(Item.sale)
+        .filter(Item.status == "SOLD")
+    )
+    query, _ = _filter_sales(query, q, date_type, date_from, date_to)
+    query = query.order_by(Sale.sale_date.desc(), Sale.item_pk_id.desc())
+    
+    # yield_per streams from a server-side cursor instead of loading every row
+    rows = (
+        [
+            row.user_item_id, row.item_description, row.brand, row.sku,
+            row.sale_date.strftime('%d/%m/%Y'), row.item_selling_price_gross,
+            row.discount_amount_gross or '', row.delivery_fee_charged_gross,
+            row.packaging_net, row.delivery_cost_net, row.other_cost_net,
+            row.item_net_revenue, row.item_vat_amount, row.item_profit, row.notes or '',
+        ]
+        for row in query.yield_per(1000)
     )
+    return csv_response("sales.csv", [
+        'Unique ID', 'Item Description', 'Brand', 'SKU', 'Sale Date',
+        'Selling Price', 'Discount', 'Delivery Fee', 'Packaging', 'Delivery Cost',
+        'Other Cost', 'Net Revenue', 'VAT', 'Profit', 'Notes',
+    ], rows)
 
 
 @routes_bp.post("/items/<pk_id>/sell")
@@ -182,13 +272,7 @@ def items_sell(pk_id):
         return jsonify({"error": "Item is already sold"}), 400
     
     # Validate required fields exist on item
-    required_fields = [
-        'user_item_id', 'order_number', 'order_date', 'arrival_date',
-        'company_name', 'brand', 'item_description', 'sku',
-        'net_unit_cost', 'freight_net', 'vat_rate'
-    ]
-    
-    missing = [f for f in required_fields if not getattr(item, f)]
+    missing = [f for f, v in zip(_SELL_REQUIRED_FIELDS, _get_sell_required(item)) if not v]
     if missing:
         return jsonify({"error": f"Item is missing required fields: {', '.join(missing)}"}), 400
     
@@ -223,7 +307,7 @@ def items_sell(pk_id):
     discount_amount = None
     if discount_type and discount_value:
         if discount_type == 'PERCENT':
-            discount_amount = (selling_price * discount_value / Decimal('100')).quantize(Decimal('0.01'))
+            discount_amount = (selling_price * discount_value / HUNDRED).quantize(CENT)
         elif discount_type == 'AMOUNT':
             discount_amount = discount_value
     
@@ -266,7 +350,9 @@ def items_sell(pk_id):
     # Audit
     audit("SALE", sale.pk_id, "CREATE", reason=f"Item sold for €{selling_price}")
     
+    flush_audit()
     db.session.commit()
+    bump_generation("items")
     
     return jsonify({"success": True, "message": "Item marked as sold"})
 
@@ -275,11 +361,12 @@ def items_sell(pk_id):
 @login_required
 def sales_edit(pk_id):
     """Edit an existing sale"""
-    sale = db.session.get(Sale, pk_id)
+    # Fetch the sale and its item in one round-trip
+    sale = db.session.get(Sale, pk_id, options=[joinedload(Sale.item)])
     if not sale:
         return jsonify({"error": "Sale not found"}), 404
     
-    item = db.session.get(Item, sale.item_pk_id)
+    item = sale.item
     if not item:
         return jsonify({"error": "Item not found"}), 404
     
@@ -314,7 +401,7 @@ def sales_edit(pk_id):
     discount_amount = None
     if discount_type and discount_value:
         if discount_type == 'PERCENT':
-            discount_amount = (selling_price * discount_value / Decimal('100')).quantize(Decimal('0.01'))
+            discount_amount = (selling_price * discount_value / HUNDRED).quantize(CENT)
         elif discount_type == 'AMOUNT':
             discount_amount = discount_value
     
@@ -329,42 +416,34 @@ def sales_edit(pk_id):
         other_cost
     )
     
-    # Audit changes
-    if sale.sale_date != new_sale_date:
-        audit("SALE", sale.pk_id, "UPDATE", field="sale_date", old=sale.sale_date, new=new_sale_date)
-    if sale.item_selling_price_gross != selling_price:
-        audit("SALE", sale.pk_id, "UPDATE", field="item_selling_price_gross", old=sale.item_selling_price_gross, new=selling_price)
-    if sale.packaging_net != packaging:
-        audit("SALE", sale.pk_id, "UPDATE", field="packaging_net", old=sale.packaging_net, new=packaging)
-    if sale.delivery_cost_net != delivery_cost:
-        audit("SALE", sale.pk_id, "UPDATE", field="delivery_cost_net", old=sale.delivery_cost_net, new=delivery_cost)
-    if sale.other_cost_net != other_cost:
-        audit("SALE", sale.pk_id, "UPDATE", field="other_cost_net", old=sale.other_cost_net, new=other_cost)
-    if sale.delivery_fee_charged_gross != delivery_fee:
-        audit("SALE", sale.pk_id, "UPDATE", field="delivery_fee_charged_gross", old=sale.delivery_fee_charged_gross, new=delivery_fee)
-    if sale.discount_type != discount_type:
-        audit("SALE", sale.pk_id, "UPDATE", field="discount_type", old=sale.discount_type, new=discount_type)
-    if sale.discount_value != discount_value:
-        audit("SALE", sale.pk_id, "UPDATE", field="discount_value", old=sale.discount_value, new=discount_value)
-    if sale.notes != notes:
-        audit("SALE", sale.pk_id, "UPDATE", field="notes", old=sale.notes, new=notes)
-    
-    # Update sale record
-    sale.sale_date = new_sale_date
-    sale.item_selling_price_gross = selling_price
-    sale.discount_type = discount_type
-    sale.discount_value = discount_value
+    # Audit changed fields (queued, then written in one batch by flush_audit) and apply
+    new_values = (
+        ("sale_date", new_sale_date),
+        ("item_selling_price_gross", selling_price),
+        ("packaging_net", packaging),
+        ("delivery_cost_net", delivery_cost),
+        ("other_cost_net", other_cost),
+        ("delivery_fee_charged_gross", delivery_fee),
+        ("discount_type", discount_type),
+        ("discount_value", discount_value),
+        ("notes", notes),
+    )
+    actor_id = current_user.pk_id
+    for field, new in new_values:
+        old = getattr(sale, field)
+        if old != new:
+            audit("SALE", sale.pk_id, "UPDATE", field=field, old=old, new=new, actor_id=actor_id)
+            setattr(sale, field, new)
+    
+    # Derived amounts
     sale.discount_amount_gross = discount_amount
-    sale.delivery_fee_charged_gross = delivery_fee
-    sale.packaging_net = packaging
-    sale.delivery_cost_net = delivery_cost
-    sale.other_cost_net = other_cost
     sale.item_net_revenue = metrics['net_revenue']
     sale.item_vat_amount = metrics['vat_amount']
     sale.item_profit = metrics['profit']
-    sale.notes = notes
     
+    flush_audit()
     db.session.commit()
+    bump_generation("items")  # sale_date drives the 'sold' filter counts
     
     return jsonify({"success": True, "message": "Sale updated successfully"})
 
@@ -373,11 +452,12 @@ def sales_edit(pk_id):
 @login_required
 def sales_reverse(pk_id):
     """Reverse a sale - return item to inventory"""
-    sale = db.session.get(Sale, pk_id)
+    # Fetch the sale and its item in one round-trip
+    sale = db.session.get(Sale, pk_id, options=[joinedload(Sale.item)])
     if not sale:
         return jsonify({"error": "Sale not found"}), 404
     
-    item = db.session.get(Item, sale.item_pk_id)
+    item = sale.item
     if not item:
         return jsonify({"error": "Item not found"}), 404
     
@@ -394,7 +474,9 @@ def sales_reverse(pk_id):
     # Return item to inventory
     item.status = "IN_STOCK"
     
+    flush_audit()
     db.session.commit()
+    bump_generation("items")
     
     return jsonify({"success": True, "message": "Sale reversed successfully"})
 
@@ -414,6 +496,7 @@ def sales_update_notes(pk_id):
     if old_notes != sale.notes:
         audit("SALE", sale.pk_id, "UPDATE", field="notes", old=old_notes, new=sale.notes)
     
+    flush_audit()
     db.session.commit()
     return {"success": True, "notes": sale.notes or ""}
 
@@ -1,98 +1,147 @@
 from flask import render_template, request, jsonify, url_for, redirect
-from flask_login import login_required, current_user
-from sqlalchemy import or_
+from flask_login import current_user
+from sqlalchemy import func, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import load_only, raiseload
 from functools import wraps
+import re
 from datetime import datetime
 import math
 from urllib.parse import urlencode
 
 from . import routes_bp
-from ..extensions import db
+from ..extensions import db, login_manager
 from ..models import User
+from ..utils.cache import bump_generation, cached
+from ..utils.pagination import page_arg, per_page_arg, page_range as _page_range
+
+
+# Columns the users table renders (plus created_at for the keyset cursor); skips password_hash
+_LIST_LOAD_ONLY = load_only(
+    User.pk_id, User.email, User.full_name, User.role, User.is_active,
+    User.last_login_at, User.created_at,
+)
+
+_VALID_ROLES = frozenset({'admin', 'user'})
+
+# Deliberately loose: one '@', no whitespace, a dot in the domain
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
 
 
 def admin_required(f):
-    """Decorator to require admin role"""
+    """Decorator to require a logged-in admin (does the login_required check too)"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not current_user.is_authenticated:
-            return redirect(url_for('auth.login'))
-        if current_user.role != 'admin':
+        user = current_user._get_current_object()  # resolve the proxy once
+        if not user.is_authenticated:
+            # Same response as login_required: redirect to the login view with ?next=
+            return login_manager.unauthorized()
+        if user.role != 'admin':
             return redirect(url_for('routes.dashboard'))
         return f(*args, **kwargs)
     return decorated_function
 
 
 @routes_bp.get("/users")
-@login_required
 @admin_required
 def users_list():
     """List all users with search and pagination"""
     q = (request.args.get("q") or "").strip()
     
     # Pagination
-    per_page = int(request.args.get("per_page", 25))
-    if per_page not in [25, 50, 100]:
-        per_page = 25
+    per_page = per_page_arg(request.args.get("per_page"))
+    
+    page = page_arg(request.args.get("page"))
     
-    page = int(request.args.get("page", 1))
-    if page < 1:
-        page = 1
+    # Keyset cursor (last row of the previous page), sent by the "next" link
+    after_created = (request.args.get("after_created") or "").strip()
+    after_id = (request.args.get("after_id") or "").strip()
     
     # Base query
     query = db.session.query(User)
     
     # Search
+    search = None
     if q:
         like = f"%{q}%"
-        query = query.filter(
-            or_(
-                User.email.ilike(like),
-                User.full_name.ilike(like),
-                User.role.ilike(like)
-            )
+        search = or_(
+            User.email.ilike(like),
+            User.full_name.ilike(like),
+            User.role.ilike(like)
         )
+        query = query.filter(search)
     
-    # Count total
-    total_count = query.count()
+    # Count the search matches and the active users in one pass over users
+    # (cached per search until a user write bumps the generation)
+    total_expr = func.count(User.pk_id)
+    if search is not None:
+        total_expr = total_expr.filter(search)
+    total_count, active_count = cached(
+        "users",
+        ("users_list", q),
+        db.session.query(total_expr, func.count(User.pk_id).filter(User.is_active == True)).one,
+    )
     total_pages = math.ceil(total_count / per_page) if total_count > 0 else 1
     
     # Ensure page doesn't exceed total pages
     if page > total_pages:
         page = total_pages
     
-    # Get users for current page
+    # Get users for current page; pk_id breaks created_at ties so pages are stable
     offset = (page - 1) * per_page
-    users = query.order_by(User.created_at.desc()).limit(per_page).offset(offset).all()
+    # Any relationship the template starts touching raises instead of lazy-loading per row
+    page_query = query.options(_LIST_LOAD_ONLY, raiseload("*")).order_by(
+        User.created_at.desc(), User.pk_id.desc()
+    )
+    cursor = None
+    if page > 1 and after_created and after_id:
+        try:
+            cursor = (datetime.fromisoformat(after_created), after_id)
+        except ValueError:
+            cursor = None
+    if cursor:
+        # Seek past the previous page instead of scanning and discarding OFFSET rows
+        users = page_query.filter(
+            tuple_(User.created_at, User.pk_id) < tuple_(*cursor)
+        ).limit(per_page).all()
+    else:
+        users = page_query.limit(per_page).offset(offset).all()
     
     # Calculate display range
     start_item = offset + 1 if total_count > 0 else 0
     end_item = min(offset + per_page, total_count)
     
     # Generate smart page range
-    page_range = []
-    if total_pages <= 7:
-        page_range = list(range(1, total_pages + 1))
-    else:
-        if page <= 4:
-            page_range = list(range(1, 6)) + ['...', total_pages]
-        elif page >= total_pages - 3:
-            page_range = [1, '...'] + list(range(total_pages - 4, total_pages + 1))
-        else:
-            page_range = [1, '...'] + list(range(page - 1, page + 2)) + ['...', total_pages]
+    page_range = _page_range(page, total_pages)
     
-    # Build URL helper
-    def build_url(target_page):
-        params = {}
-        if q:
-            params['q'] = q
-        if per_page != 25:
-            params['per_page'] = per_page
-        params['page'] = target_page
-        return url_for('routes.users_list') + '?' + urlencode(params)
+    # Build URL helper: the filter part of the query string is the same for
+    # every pager link, so resolve the route and encode it once
+    params = {}
+    if q:
+        params['q'] = q
+    if per_page != 25:
+        params['per_page'] = per_page
+    fixed_qs = urlencode(params)
+    page_url = url_for('routes.users_list') + '?' + (fixed_qs + '&' if fixed_qs else '') + 'page='
     
-    # Count active users
-    active_count = db.session.query(User).filter(User.is_active == True).count()
+    # Pager links as (label, href, is_current) so the template is a plain loop;
+    # href is None for the '...' gaps
+    pager = [
+        (p, None if p == '...' else f"{page_url}{p}", p == page)
+        for p in page_range
+    ]
+    prev_url = f"{page_url}{page - 1}" if page > 1 else None
+    
+    # "Next" carries a cursor so the following page is a seek, not an OFFSET
+    next_url = None
+    if page < total_pages:
+        next_url = f"{page_url}{page + 1}"
+        if users:
+            last = users[-1]
+            next_url += '&' + urlencode({
+                'after_created': last.created_at.isoformat(),
+                'after_id': last.pk_id,
+            })
     
     return render_template(
         "users/list.html",
@@ -105,14 +154,14 @@ def users_list():
         total_count=total_count,
         start_item=start_item,
         end_item=end_item,
-        page_range=page_range,
-        build_url=build_url,
+        pager=pager,
+        prev_url=prev_url,
+        next_url=next_url,
         active_count=active_count
     )
 
 
 @routes_bp.post("/users/add")
-@login_required
 @admin_required
 def users_add():
     """Create a new user"""
@@ -129,24 +178,37 @@ def users_add():
         if len(password) < 8:
             return jsonify({"error": "Password must be at least 8 characters"}), 400
         
-        if role not in ['admin', 'user']:
+        if role not in _VALID_ROLES:
             return jsonify({"error": "Invalid role"}), 400
         
-        # Check if email already exists
-        if db.session.query(User).filter(User.email == email).first():
-            return jsonify({"error": "Email already exists"}), 400
+        # Cheap shape check so malformed addresses never reach the uniqueness probe
+        if not _EMAIL_RE.match(email):
+            return jsonify({"error": "Invalid email address"}), 400
         
-        # Create user
-        user = User(
-            email=email,
-            full_name=full_name,
-            role=role,
-            is_active=True
-        )
+        # Hash via the model so the scheme stays in one place
+        user = User()
         user.set_password(password)
         
-        db.session.add(user)
+        # Create user; the unique email index decides duplicates in the same
+        # round-trip, so there is no SELECT-then-INSERT race between admins
+        created = db.session.execute(
+            pg_insert(User)
+            .values(
+                email=email,
+                full_name=full_name,
+                role=role,
+                is_active=True,
+                password_hash=user.password_hash,
+            )
+            .on_conflict_do_nothing(index_elements=[User.email])
+            .returning(User.pk_id)
+        ).scalar()
+        if created is None:
+            db.session.rollback()
+            return jsonify({"error": "Email already exists"}), 400
+        
         db.session.commit()
+        bump_generation("users")
         
         return jsonify({"success": True, "message": "User created successfully"}), 200
         
@@ -156,12 +218,11 @@ def users_add():
 
 
 @routes_bp.post("/users/<pk_id>/edit")
-@login_required
 @admin_required
 def users_edit(pk_id):
     """Edit an existing user"""
     try:
-        user = db.session.query(User).filter(User.pk_id == pk_id).first()
+        user = db.session.get(User, pk_id)
         if not user:
             return jsonify({"error": "User not found"}), 404
         
@@ -174,13 +235,19 @@ def users_edit(pk_id):
         if not email or not full_name:
             return jsonify({"error": "Email and full name are required"}), 400
         
-        if role not in ['admin', 'user']:
+        if role not in _VALID_ROLES:
             return jsonify({"error": "Invalid role"}), 400
         
-        # Check if email already exists (excluding current user)
-        existing_user = db.session.query(User).filter(User.email == email, User.pk_id != pk_id).first()
-        if existing_user:
-            return jsonify({"error": "Email already exists"}), 400
+        # Cheap shape check so malformed addresses never reach the uniqueness probe
+        # (only for a new address, so existing accounts stay editable)
+        if email != user.email and not _EMAIL_RE.match(email):
+            return jsonify({"error": "Invalid email address"}), 400
+        
+        # Check if email already exists (excluding current user); unchanged emails can't clash
+        if email != user.email:
+            existing_user = db.session.query(User).filter(User.email == email, User.pk_id != pk_id).first()
+            if existing_user:
+                return jsonify({"error": "Email already exists"}), 400
         
         # Update user
         user.email = email
@@ -194,6 +261,7 @@ def users_edit(pk_id):
             user.set_password(password)
         
         db.session.commit()
+        bump_generation("users")
         
         return jsonify({"success": True, "message": "User updated successfully"}), 200
         
@@ -203,12 +271,11 @@ def users_edit(pk_id):
 
 
 @routes_bp.post("/users/<pk_id>/deactivate")
-@login_required
 @admin_required
 def users_deactivate(pk_id):
     """Deactivate a user"""
     try:
-        user = db.session.query(User).filter(User.pk_id == pk_id).first()
+        user = db.session.get(User, pk_id)
         if not user:
             return jsonify({"error": "User not found"}), 404
         
@@ -216,8 +283,11 @@ def users_deactivate(pk_id):
         if user.pk_id == current_user.pk_id:
             return jsonify({"error": "Cannot deactivate your own account"}), 400
         
-        user.is_active = False
-        db.session.commit()
+        # Already inactive (e.g. a double-click): nothing to write
+        if user.is_active:
+            user.is_active = False
+            db.session.commit()
+            bump_generation("users")
         
         return jsonify({"success": True, "message": "User deactivated successfully"}), 200
         
@@ -227,17 +297,19 @@ def users_deactivate(pk_id):
 
 
 @routes_bp.post("/users/<pk_id>/reactivate")
-@login_required
 @admin_required
 def users_reactivate(pk_id):
     """Reactivate a user"""
     try:
-        user = db.session.query(User).filter(User.pk_id == pk_id).first()
+        user = db.session.get(User, pk_id)
         if not user:
             return jsonify({"error": "User not found"}), 404
         
-        user.is_active = True
-        db.session.commit()
+        # Already active: nothing to write
+        if not user.is_active:
+            user.is_active = True
+            db.session.commit()
+            bump_generation("users")
         
         return jsonify({"success": True, "message": "User reactivated successfully"}), 200
         
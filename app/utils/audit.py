@@ -0,0 +1,32 @@
+"""
+Audit log helpers
+Queues audit entries for the current request and writes them in one batch
+"""
+from flask import g
+from flask_login import current_user
+from app.extensions import db
+from app.models import AuditLog
+
+
+def audit(entity_type, entity_pk_id, action, field=None, old=None, new=None, reason=None, actor_id=None):
+    """Queue an audit log entry; written to the session by flush_audit()
+
+    Callers auditing in a loop can pass actor_id to skip resolving current_user each time.
+    """
+    g.setdefault("audit_buffer", []).append({
+        "entity_type": entity_type,
+        "entity_pk_id": entity_pk_id,
+        "action": action,
+        "field_name": field,
+        "old_value": None if old is None else str(old),
+        "new_value": None if new is None else str(new),
+        "reason": reason,
+        "actor_user_id": actor_id if actor_id is not None else getattr(current_user, "pk_id", None),
+    })
+
+
+def flush_audit():
+    """Insert all queued audit entries with a single executemany (call before commit)"""
+    buffer = g.pop("audit_buffer", None)
+    if buffer:
+        db.session.bulk_insert_mappings(AuditLog, buffer)
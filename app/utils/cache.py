@@ -0,0 +1,51 @@
+"""
+In-process query result cache with generation-based invalidation
+
+Writers bump a namespace's generation so every existing key for it becomes
+unreachable at once. Both the store and the generations are per process, so
+bump_generation() only invalidates the worker that handled the write: under
+several gunicorn workers, the others keep serving their cached values until
+the TTL expires. Cached counts and totals can therefore be up to ttl seconds
+(30 by default) stale after a write made elsewhere; only use this for
+figures where that is acceptable.
+"""
+import time
+from threading import Lock
+
+_lock = Lock()
+_generations = {}
+_store = {}
+
+# Crude bound on memory: the store is simply emptied when it grows past this
+MAX_ENTRIES = 2048
+
+
+def bump_generation(namespace: str) -> None:
+    """Invalidate every cached value in a namespace (call after a write)"""
+    with _lock:
+        _generations[namespace] = _generations.get(namespace, 0) + 1
+
+
+def cached(namespace: str, key: tuple, compute, ttl: int = 30):
+    """
+    Return the cached value for key, calling compute() on a miss
+
+    Args:
+        namespace: Invalidation group, e.g. 'items'
+        key: Hashable tuple identifying the query (filters etc.)
+        compute: Zero-argument callable producing the value
+        ttl: Seconds a value stays valid
+    """
+    full_key = (namespace, _generations.get(namespace, 0), key)
+    now = time.monotonic()
+
+    hit = _store.get(full_key)
+    if hit is not None and hit[0] > now:
+        return hit[1]
+
+    value = compute()
+    with _lock:
+        if len(_store) >= MAX_ENTRIES:
+            _store.clear()
+        _store[full_key] = (now + ttl, value)
+    return value
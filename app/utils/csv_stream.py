@@ -0,0 +1,32 @@
+"""
+Streaming CSV downloads shared by the export routes
+"""
+import csv
+
+from flask import Response, stream_with_context
+
+
+class _Echo:
+    """File-like sink so csv.writer returns each formatted row instead of buffering it"""
+    def write(self, value):
+        return value
+
+
+def csv_response(filename: str, header, rows) -> Response:
+    """
+    Stream header and then each row as a CSV attachment
+
+    rows is consumed lazily while the response is sent (e.g. a generator over
+    query.yield_per(...)), so the export is never held in memory as a whole.
+    """
+    def generate():
+        writer = csv.writer(_Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
@@ -0,0 +1,42 @@
+"""
+Pagination helpers shared by the list pages
+"""
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1024)
+def page_range(page: int, total_pages: int) -> tuple:
+    """
+    Page numbers to show in the pager, with '...' for elided runs
+
+    Up to 7 pages are all shown; otherwise the first and last page are kept
+    around a window of five pages at either end or three in the middle.
+    Memoized: the result depends only on (page, total_pages).
+    """
+    if total_pages <= 7:
+        return tuple(range(1, total_pages + 1))
+    if page <= 4:
+        # Near start: 1 2 3 4 5 ... last
+        return (1, 2, 3, 4, 5, '...', total_pages)
+    if page >= total_pages - 3:
+        # Near end: 1 ... -4 -3 -2 -1 last
+        return (1, '...', *range(total_pages - 4, total_pages + 1))
+    # Middle: 1 ... page-1 page page+1 ... last
+    return (1, '...', page - 1, page, page + 1, '...', total_pages)
+
+
+# Allowed ?per_page= values, keyed by the raw query-string value
+PER_PAGE = {"25": 25, "50": 50, "100": 100}
+
+
+def per_page_arg(value, default: int = 25) -> int:
+    """Rows per page from a raw ?per_page= value; anything not offered falls back to default"""
+    return PER_PAGE.get(value, default)
+
+
+def page_arg(value) -> int:
+    """1-based page number from a raw ?page= value; junk or out-of-range input means page 1"""
+    # ASCII digits only (str.isdigit also accepts e.g. '²'), and short enough to be a real page
+    if value and len(value) <= 9 and value.isascii() and value.isdigit():
+        return int(value) or 1
+    return 1
@@ -0,0 +1,98 @@
+"""
+Audit trail of the inline comments edit (POST /items/<pk_id>/update-comments)
+
+Runs against a throwaway SQLite file: python -m unittest discover tests
+"""
+import os
+import tempfile
+import unittest
+from datetime import date
+from decimal import Decimal
+
+_db_fd, _db_path = tempfile.mkstemp(suffix=".sqlite")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_path}"
+
+from app import create_app  # noqa: E402  (Config reads DATABASE_URL at import)
+from app.extensions import db  # noqa: E402
+from app.models import AuditLog, Item, User  # noqa: E402
+
+
+class UpdateCommentsAuditTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app()
+        cls.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.close(_db_fd)
+        os.unlink(_db_path)
+
+    def setUp(self):
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        user = User(email="tester@example.com", full_name="Tester", role="admin")
+        user.set_password("password123")
+        item = Item(
+            user_item_id="U-1", order_number="PO-1",
+            order_date=date(2024, 1, 5), arrival_date=date(2024, 1, 9),
+            company_name="Acme", brand="Brand", item_description="Widget", sku="SKU-1",
+            net_unit_cost=Decimal("10.00"), freight_net=Decimal("1.00"), vat_rate=Decimal("0.18"),
+            comments="before",
+        )
+        db.session.add_all([user, item])
+        db.session.commit()
+        self.user_pk, self.item_pk = user.pk_id, item.pk_id
+
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["_user_id"] = self.user_pk
+            sess["_fresh"] = True
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _post(self, comments, pk_id=None):
+        return self.client.post(
+            f"/items/{pk_id or self.item_pk}/update-comments", data={"comments": comments}
+        )
+
+    def _audit_rows(self):
+        return db.session.query(AuditLog).filter_by(entity_type="ITEM", entity_pk_id=self.item_pk).all()
+
+    def test_audit_records_previous_and_new_value(self):
+        resp = self._post("  after  ")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json(), {"success": True, "comments": "after"})
+
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Item, self.item_pk).comments, "after")
+        (row,) = self._audit_rows()
+        self.assertEqual((row.field_name, row.old_value, row.new_value), ("comments", "before", "after"))
+        self.assertEqual(row.actor_user_id, self.user_pk)
+
+    def test_clearing_comments_audits_none(self):
+        self._post("")
+
+        db.session.expire_all()
+        self.assertIsNone(db.session.get(Item, self.item_pk).comments)
+        (row,) = self._audit_rows()
+        self.assertEqual((row.old_value, row.new_value), ("before", None))
+
+    def test_unchanged_comments_write_no_audit(self):
+        resp = self._post("before")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self._audit_rows(), [])
+
+    def test_unknown_item_is_404(self):
+        resp = self._post("x", pk_id="missing")
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(db.session.query(AuditLog).count(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()